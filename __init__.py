@@ -10,5 +10,6 @@ def classFactory(iface):
     :param iface: Interface QGIS (QgsInterface)
     :type iface: QgsInterface
     """
+    # Import local pour ne charger le plugin qu'à son activation
     from .transport_plugin import TransportExceptionnelPlugin
     return TransportExceptionnelPlugin(iface)
\ No newline at end of file
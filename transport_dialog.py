@@ -5,16 +5,18 @@ Permet de sélectionner : MNH (raster), Tracé (LineString), Type de turbine
 
 from qgis.PyQt.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QLabel, 
-    QComboBox, QPushButton, QMessageBox
+    QComboBox, QPushButton, QMessageBox, QProgressBar
 )
 from qgis.PyQt.QtCore import Qt
 from qgis.gui import QgsMapLayerComboBox
-from qgis.core import (
-    QgsMapLayerProxyModel, QgsProject, QgsWkbTypes,
-    QgsVectorLayer, QgsRasterLayer
-)
-import processing
+from qgis.core import QgsMapLayerProxyModel, QgsProject, QgsWkbTypes
 import tempfile
+import hashlib
+import json
+import pathlib
+import shutil
+import atexit
+import html
 import os
 
 
@@ -28,10 +30,71 @@ class TransportDialog(QDialog):
         'E82': {'blade_length': 45.0, 'description': 'E82 (45m)'}
     }
     
-    def __init__(self, parent=None):
+    # Paramètres numériques de l'analyse
+    ANALYSIS_PARAMS = {
+        'HEIGHT_REQUIRED': 5.0,
+        'TRANSECT_SPACING': 1.0,
+        'SAMPLE_POINTS': 9
+    }
+    
+    # Sorties de l'algorithme dans le dossier de résultats : les couches sont
+    # des tables d'un GeoPackage unique, les rapports des fichiers à côté
+    RESULTS_GPKG = 'resultats.gpkg'
+    OUTPUT_TABLES = {
+        'OUTPUT_ENVELOPE': 'envelope',
+        'OUTPUT_STATIONS': 'stations',
+        'OUTPUT_OBSTACLES': 'obstacles'
+    }
+    OUTPUT_FILES = {
+        'OUTPUT_CSV': 'rapport.csv',
+        'OUTPUT_REPORT': 'rapport.txt'
+    }
+    
+    # Noms des couches résultats dans le projet
+    LAYER_NAMES = {
+        'OUTPUT_ENVELOPE': 'Enveloppe dynamique',
+        'OUTPUT_STATIONS': 'Stations d\'analyse',
+        'OUTPUT_OBSTACLES': 'Obstacles détectés'
+    }
+    
+    # Cache disque des analyses déjà calculées (un dossier par clé d'entrées)
+    CACHE_DIR = pathlib.Path(tempfile.gettempdir()) / 'wt_cache'
+    
+    # Style et messages de l'interface (traduits à l'utilisation via self.tr)
+    _RUN_BTN_QSS = "QPushButton { background-color: #4CAF50; color: white; padding: 10px; font-weight: bold; }"
+    _TITLE_ERROR = "Erreur"
+    _TITLE_SUCCESS = "Succès"
+    _ERR_CRS = "Transformation impossible entre le CRS du tracé et celui du MNH"
+    _ERR_NO_ALGORITHM = "Algorithme 'transport_exceptionnel' introuvable dans Processing"
+    _ERR_ANALYSIS = (
+        "Erreur lors de l'analyse (voir le journal Processing)\n\n"
+        "Vérifiez :\n"
+        "- Le tracé couvre bien la zone du MNH\n"
+        "- Les CRS sont compatibles\n"
+        "- Le MNH contient des données valides"
+    )
+    
+    def __init__(self, parent=None, use_memory_sinks=False):
+        """
+        :param use_memory_sinks: Produit les couches résultats en mémoire
+            plutôt que dans un GeoPackage (sans cache disque)
+        :type use_memory_sinks: bool
+        """
         super().__init__(parent)
+        self.use_memory_sinks = use_memory_sinks
         self.setWindowTitle("Analyse Transport Exceptionnel - Éoliennes")
         self.setMinimumWidth(500)
+        
+        # Index du type de pale dans l'énumération BLADE_TYPE de l'algorithme
+        self._turbine_index = {key: i for i, key in enumerate(self.TURBINE_SPECS)}
+        
+        # Tâche Processing en cours (exécutée hors du thread de l'interface)
+        self._task = None
+        self._context = None
+        self._feedback = None
+        self._work_dir = None
+        self._cache_dir = None
+        
         self.setup_ui()
     
     def setup_ui(self):
@@ -63,17 +126,33 @@ class TransportDialog(QDialog):
         turbine_layout = QHBoxLayout()
         turbine_layout.addWidget(QLabel("Type de pale:"))
         self.turbine_combo = QComboBox()
-        for key, spec in self.TURBINE_SPECS.items():
-            self.turbine_combo.addItem(spec['description'], key)
+        # Remplissage en un seul appel, la clé de turbine en donnée associée
+        self.turbine_combo.blockSignals(True)
+        self.turbine_combo.addItems([spec['description'] for spec in self.TURBINE_SPECS.values()])
+        for i, key in enumerate(self.TURBINE_SPECS):
+            self.turbine_combo.setItemData(i, key)
+        self.turbine_combo.blockSignals(False)
         turbine_layout.addWidget(self.turbine_combo)
         layout.addLayout(turbine_layout)
         
+        # Récapitulatif des choix, tenu à jour à chaque sélection
+        self.summary = QLabel()
+        self.summary.setTextFormat(Qt.RichText)
+        self.summary.setWordWrap(True)
+        layout.addWidget(self.summary)
+        
+        # Progression de l'analyse (visible pendant l'exécution)
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.setVisible(False)
+        layout.addWidget(self.progress_bar)
+        
         # Boutons
         button_layout = QHBoxLayout()
         
         self.run_button = QPushButton("Lancer l'analyse")
         self.run_button.clicked.connect(self.run_analysis)
-        self.run_button.setStyleSheet("QPushButton { background-color: #4CAF50; color: white; padding: 10px; font-weight: bold; }")
+        self.run_button.setStyleSheet(self._RUN_BTN_QSS)
         
         self.cancel_button = QPushButton("Annuler")
         self.cancel_button.clicked.connect(self.reject)
@@ -84,142 +163,321 @@ class TransportDialog(QDialog):
         layout.addLayout(button_layout)
         
         self.setLayout(layout)
+        
+        # Validation des couches dès leur sélection plutôt qu'au lancement
+        self.trace_combo.layerChanged.connect(self._validate_inputs)
+        self.mnh_combo.layerChanged.connect(self._validate_inputs)
+        self._validate_inputs()
+        
+        self.trace_combo.layerChanged.connect(self._refresh_summary)
+        self.mnh_combo.layerChanged.connect(self._refresh_summary)
+        self.turbine_combo.currentIndexChanged.connect(self._refresh_summary)
+        self._refresh_summary()
+    
+    def inputs_valid(self):
+        """Indique si le tracé (LineString) et le MNH sélectionnés sont utilisables"""
+        trace_layer = self.trace_combo.currentLayer()
+        mnh_layer = self.mnh_combo.currentLayer()
+        return (
+            trace_layer is not None
+            and trace_layer.geometryType() == QgsWkbTypes.LineGeometry
+            and mnh_layer is not None
+            and mnh_layer.isValid()
+        )
+    
+    def _refresh_summary(self):
+        """Met à jour le récapitulatif des paramètres de l'analyse"""
+        trace_layer = self.trace_combo.currentLayer()
+        mnh_layer = self.mnh_combo.currentLayer()
+        trace_name = html.escape(trace_layer.name()) if trace_layer else '-'
+        mnh_name = html.escape(mnh_layer.name()) if mnh_layer else '-'
+        spec = self.TURBINE_SPECS[self.turbine_combo.currentData()]
+        
+        self.summary.setText(
+            f"<b>Tracé :</b> {trace_name} | "
+            f"<b>MNH :</b> {mnh_name} | "
+            f"<b>Pale :</b> {spec['description']} ({spec['blade_length']} m)"
+        )
+    
+    def _validate_inputs(self):
+        """Active le bouton de lancement si les entrées sont valides et qu'aucune analyse ne tourne"""
+        self.run_button.setEnabled(self._task is None and self.inputs_valid())
     
     def run_analysis(self):
         """Lance l'analyse avec les paramètres sélectionnés"""
+        # Imports locaux : Processing n'est chargé qu'au lancement d'une analyse,
+        # pas à l'ouverture du dialogue
+        from qgis.core import (
+            QgsApplication, QgsProcessingContext, QgsProcessingFeedback,
+            QgsProcessingAlgRunnerTask, QgsCoordinateTransform
+        )
         
-        # Validation des entrées
-        trace_layer = self.trace_combo.currentLayer()
-        if not trace_layer:
-            QMessageBox.warning(
-                self, 
-                "Erreur", 
-                "Veuillez sélectionner une couche de tracé (LineString)"
-            )
+        # Les entrées sont validées à leur sélection (_validate_inputs) :
+        # le bouton n'est actif que si elles sont utilisables
+        if not self.inputs_valid():
             return
         
+        trace_layer = self.trace_combo.currentLayer()
         mnh_layer = self.mnh_combo.currentLayer()
-        if not mnh_layer:
-            QMessageBox.warning(
-                self, 
-                "Erreur", 
-                "Veuillez sélectionner un raster MNH"
-            )
-            return
-        
-        # Validation géométrie du tracé
-        if trace_layer.geometryType() != QgsWkbTypes.LineGeometry:
-            QMessageBox.warning(
-                self,
-                "Erreur",
-                "La couche de tracé doit être de type LineString"
-            )
-            return
         
         # Récupération du type de turbine
         turbine_key = self.turbine_combo.currentData()
-        turbine_idx = list(self.TURBINE_SPECS.keys()).index(turbine_key)
-        
-        # Affichage confirmation
-        turbine_name = self.TURBINE_SPECS[turbine_key]['description']
-        blade_length = self.TURBINE_SPECS[turbine_key]['blade_length']
-        
-        confirm = QMessageBox.question(
-            self,
-            "Confirmation",
-            f"Lancer l'analyse avec :\n\n"
-            f"• Tracé : {trace_layer.name()}\n"
-            f"• MNH : {mnh_layer.name()}\n"
-            f"• Pale : {turbine_name} ({blade_length}m)\n\n"
-            f"Continuer ?",
-            QMessageBox.Yes | QMessageBox.No
-        )
+        turbine_idx = self._turbine_index[turbine_key]
         
-        if confirm != QMessageBox.Yes:
+        # Transformation tracé -> MNH vérifiée avant de lancer une longue analyse
+        transform = QgsCoordinateTransform(
+            trace_layer.crs(), mnh_layer.crs(), QgsProject.instance().transformContext()
+        )
+        if not transform.isValid():
+            QMessageBox.warning(self, self.tr(self._TITLE_ERROR), self.tr(self._ERR_CRS))
             return
         
-        # Créer un dossier temporaire pour les sorties
-        temp_dir = tempfile.gettempdir()
+        # Pas de confirmation modale : le récapitulatif affiché dans le
+        # dialogue reflète déjà les choix au moment du clic.
+        # Réutilisation d'une analyse déjà calculée avec les mêmes entrées
+        # (les couches en mémoire ne peuvent pas être mises en cache)
+        if self.use_memory_sinks:
+            key = None
+        else:
+            key = self.cache_key(trace_layer, mnh_layer, turbine_key)
         
-        # Préparation des paramètres avec fichiers shapefile
+        if key is not None:
+            cache_dir = self.CACHE_DIR / key
+            if self.is_cached(cache_dir):
+                self.load_results(self.open_result_layers(cache_dir), cache_dir)
+                return
+            
+            # Les résultats sont écrits à part puis renommés en une fois :
+            # une analyse interrompue ne laisse jamais un cache incomplet
+            work_dir = self.CACHE_DIR / f"{key}.part"
+            shutil.rmtree(work_dir, ignore_errors=True)
+            work_dir.mkdir(parents=True, exist_ok=True)
+        else:
+            cache_dir = None
+            work_dir = pathlib.Path(tempfile.mkdtemp(prefix='wt_'))
+            # Hors cache, les résultats ne servent que pour la session
+            atexit.register(shutil.rmtree, str(work_dir), True)
+        
+        # Préparation des paramètres avec sorties GeoPackage. Le MNH est
+        # transmis tel quel : l'algorithme n'en lit que des fenêtres bornées
+        # autour des stations, dans la tâche de fond
         params = {
             'INPUT_TRACE': trace_layer,
             'INPUT_MNH': mnh_layer,
-            'BLADE_TYPE': turbine_idx,
-            'HEIGHT_REQUIRED': 5.0,
-            'TRANSECT_SPACING': 1.0,
-            'SAMPLE_POINTS': 9,
-            'OUTPUT_ENVELOPE': os.path.join(temp_dir, 'envelope_transport.shp'),
-            'OUTPUT_STATIONS': os.path.join(temp_dir, 'stations_transport.shp'),
-            'OUTPUT_OBSTACLES': os.path.join(temp_dir, 'obstacles_transport.shp'),
-            'OUTPUT_CSV': os.path.join(temp_dir, 'rapport_transport.csv'),
-            'OUTPUT_REPORT': os.path.join(temp_dir, 'rapport_transport.txt')
+            'BLADE_TYPE': turbine_idx
         }
+        params.update(self.ANALYSIS_PARAMS)
+        params.update(self.output_paths(work_dir))
         
-        try:
-            # Lancement de l'algorithme
-            result = processing.run(
-                'transport_exceptionnel:transport_exceptionnel',
-                params
+        alg = QgsApplication.processingRegistry().algorithmById(
+            'transport_exceptionnel:transport_exceptionnel'
+        )
+        if alg is None:
+            QMessageBox.critical(
+                self,
+                self.tr(self._TITLE_ERROR),
+                self.tr(self._ERR_NO_ALGORITHM)
             )
-            
-            # Charger les shapefiles créés
-            envelope = QgsVectorLayer(result['OUTPUT_ENVELOPE'], 'Enveloppe dynamique', 'ogr')
-            stations = QgsVectorLayer(result['OUTPUT_STATIONS'], 'Stations d\'analyse', 'ogr')
-            
-            layers_added = 0
-            msg = "Analyse terminée !\n\n"
-            
-            # Ajouter l'enveloppe
-            if envelope.isValid() and envelope.featureCount() > 0:
-                QgsProject.instance().addMapLayer(envelope)
-                msg += f"✓ Enveloppe : {envelope.featureCount()} entité(s)\n"
-                layers_added += 1
-            else:
-                msg += "⚠ Enveloppe : vide ou invalide\n"
-            
-            # Ajouter les stations
-            if stations.isValid() and stations.featureCount() > 0:
-                QgsProject.instance().addMapLayer(stations)
-                msg += f"✓ Stations : {stations.featureCount()} entité(s)\n"
-                layers_added += 1
-            else:
-                msg += "⚠ Stations : vide ou invalide\n"
-            
-            # Ajouter les obstacles si présents
-            if result.get('OUTPUT_OBSTACLES') and os.path.exists(result['OUTPUT_OBSTACLES']):
-                obstacles = QgsVectorLayer(result['OUTPUT_OBSTACLES'], 'Obstacles détectés', 'ogr')
-                if obstacles.isValid() and obstacles.featureCount() > 0:
-                    QgsProject.instance().addMapLayer(obstacles)
-                    msg += f"✓ Obstacles : {obstacles.featureCount()} entité(s)\n"
-                    layers_added += 1
-                else:
-                    msg += "✓ Obstacles : aucun\n"
-            else:
-                msg += "✓ Obstacles : aucun\n"
-            
-            msg += f"\n{layers_added} couche(s) ajoutée(s) au projet"
-            msg += f"\n\nRapports générés dans :\n{temp_dir}"
-            
-            # Message de succès
-            QMessageBox.information(self, "Succès", msg)
-            
-            # Fermer le dialogue
-            self.accept()
-            
-        except Exception as e:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            return
+        
+        # Lancement de l'algorithme dans une tâche de fond : le projet n'est
+        # manipulé que depuis _on_finished, dans le thread principal
+        self._work_dir = work_dir
+        self._cache_dir = cache_dir
+        self._context = QgsProcessingContext()
+        self._context.setProject(QgsProject.instance())
+        self._feedback = QgsProcessingFeedback()
+        self._feedback.progressChanged.connect(self._on_progress)
+        
+        self._task = QgsProcessingAlgRunnerTask(alg, params, self._context, self._feedback)
+        self._task.executed.connect(self._on_finished)
+        
+        self.run_button.setEnabled(False)
+        self.progress_bar.setValue(0)
+        self.progress_bar.setVisible(True)
+        
+        QgsApplication.taskManager().addTask(self._task)
+    
+    def cache_key(self, trace_layer, mnh_layer, turbine_key):
+        """
+        Calcule la clé de cache d'une analyse à partir de ses entrées
+        
+        Retourne None si une couche n'est pas un fichier sur disque ou si le
+        tracé a des modifications non enregistrées : son contenu ne peut alors
+        pas être identifié de façon fiable.
+        """
+        from .transport_exceptionnel_algorithm import TransportExceptionnelAlgorithm
+        
+        if trace_layer.isModified():
+            return None
+        
+        # La version des résultats écarte les analyses d'un algorithme antérieur
+        inputs = {
+            'turbine': turbine_key,
+            'params': self.ANALYSIS_PARAMS,
+            'version': TransportExceptionnelAlgorithm.RESULTS_VERSION
+        }
+        for name, layer in (('trace', trace_layer), ('mnh', mnh_layer)):
+            path = layer.source().split('|')[0]
+            if not os.path.isfile(path):
+                return None
+            inputs[name] = layer.source()
+            inputs[f'{name}_mtime'] = os.path.getmtime(path)
+        
+        return hashlib.blake2b(
+            json.dumps(inputs, sort_keys=True).encode(), digest_size=16
+        ).hexdigest()
+    
+    def output_paths(self, directory):
+        """Destinations des sorties de l'algorithme dans le dossier donné"""
+        if self.use_memory_sinks:
+            outputs = {
+                name: f'memory:{table}'
+                for name, table in self.OUTPUT_TABLES.items()
+            }
+        else:
+            gpkg = pathlib.Path(directory) / self.RESULTS_GPKG
+            outputs = {
+                name: f'ogr:dbname=\'{gpkg}\' table="{table}" (geom)'
+                for name, table in self.OUTPUT_TABLES.items()
+            }
+        outputs.update({
+            name: str(pathlib.Path(directory) / filename)
+            for name, filename in self.OUTPUT_FILES.items()
+        })
+        return outputs
+    
+    def open_result_layers(self, directory):
+        """Ouvre les couches résultats du GeoPackage du dossier donné"""
+        from qgis.core import QgsVectorLayer
+        
+        gpkg = pathlib.Path(directory) / self.RESULTS_GPKG
+        return {
+            name: QgsVectorLayer(f'{gpkg}|layername={table}', self.LAYER_NAMES[name], 'ogr')
+            for name, table in self.OUTPUT_TABLES.items()
+        }
+    
+    def is_cached(self, directory):
+        """Indique si le dossier contient une analyse complète"""
+        files = [self.RESULTS_GPKG] + list(self.OUTPUT_FILES.values())
+        return all((pathlib.Path(directory) / name).exists() for name in files)
+    
+    def _on_progress(self, progress):
+        """Met à jour la barre de progression"""
+        self.progress_bar.setValue(int(progress))
+    
+    def _on_finished(self, ok, results):
+        """Charge les résultats dans le projet une fois la tâche terminée"""
+        canceled = self._feedback.isCanceled()
+        context = self._context
+        work_dir = self._work_dir
+        cache_dir = self._cache_dir
+        self._task = None
+        self._context = None
+        self._feedback = None
+        self._work_dir = None
+        self._cache_dir = None
+        
+        self.progress_bar.setVisible(False)
+        self._validate_inputs()
+        
+        # Couches en mémoire : récupérées depuis le contexte de la tâche
+        layers = {}
+        if ok and not canceled and self.use_memory_sinks:
+            for name in self.OUTPUT_TABLES:
+                layer = context.takeResultLayer(results[name]) if results.get(name) else None
+                if layer is not None:
+                    layer.setName(self.LAYER_NAMES[name])
+                layers[name] = layer
+        
+        # Libération des couches temporaires du contexte : sous Windows, un
+        # fichier encore ouvert ne peut être ni supprimé ni déplacé
+        context.temporaryLayerStore().removeAllMapLayers()
+        context = None
+        
+        if canceled or not ok:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        
+        if canceled:
+            return
+        
+        if not ok:
             QMessageBox.critical(
                 self,
-                "Erreur",
-                f"Erreur lors de l'analyse :\n\n{str(e)}\n\n"
-                f"Vérifiez :\n"
-                f"- Le tracé couvre bien la zone du MNH\n"
-                f"- Les CRS sont compatibles\n"
-                f"- Le MNH contient des données valides"
+                self.tr(self._TITLE_ERROR),
+                self.tr(self._ERR_ANALYSIS)
             )
-            import traceback
-            print("Trace complète de l'erreur :")
-            traceback.print_exc()
+            return
+        
+        if self.use_memory_sinks:
+            self.load_results(layers, work_dir)
+            return
+        
+        result_dir = work_dir
+        if cache_dir is not None:
+            try:
+                shutil.rmtree(cache_dir, ignore_errors=True)
+                os.replace(work_dir, cache_dir)
+                result_dir = cache_dir
+            except OSError:
+                # Renommage impossible : résultats lus depuis le dossier de
+                # travail, sans mise en cache
+                pass
+        
+        self.load_results(self.open_result_layers(result_dir), result_dir)
+    
+    def load_results(self, layers, report_dir):
+        """Ajoute les couches résultats au projet et affiche la synthèse"""
+        envelope = layers['OUTPUT_ENVELOPE']
+        stations = layers['OUTPUT_STATIONS']
+        obstacles = layers['OUTPUT_OBSTACLES']
+        
+        layers_added = 0
+        parts = ["Analyse terminée !", ""]
+        
+        # Ajouter l'enveloppe
+        if envelope is not None and envelope.isValid() and envelope.featureCount() > 0:
+            QgsProject.instance().addMapLayer(envelope)
+            parts.append(f"✓ Enveloppe : {envelope.featureCount()} entité(s)")
+            layers_added += 1
+        else:
+            parts.append("⚠ Enveloppe : vide ou invalide")
+        
+        # Ajouter les stations
+        if stations is not None and stations.isValid() and stations.featureCount() > 0:
+            QgsProject.instance().addMapLayer(stations)
+            parts.append(f"✓ Stations : {stations.featureCount()} entité(s)")
+            layers_added += 1
+        else:
+            parts.append("⚠ Stations : vide ou invalide")
+        
+        # Ajouter les obstacles si présents (couche absente s'il n'y en a aucun)
+        if obstacles is not None and obstacles.isValid() and obstacles.featureCount() > 0:
+            QgsProject.instance().addMapLayer(obstacles)
+            parts.append(f"✓ Obstacles : {obstacles.featureCount()} entité(s)")
+            layers_added += 1
+        else:
+            parts.append("✓ Obstacles : aucun")
+        
+        parts.append("")
+        parts.append(f"{layers_added} couche(s) ajoutée(s) au projet")
+        parts.append("")
+        parts.append("Rapports générés dans :")
+        parts.append(str(report_dir))
+        
+        # Message de succès
+        QMessageBox.information(self, self.tr(self._TITLE_SUCCESS), "\n".join(parts))
+        
+        # Fermer le dialogue
+        self.accept()
+    
+    def reject(self):
+        """Annule l'analyse en cours, ou ferme le dialogue si aucune n'est lancée"""
+        if self._task is not None:
+            self._task.cancel()
+            return
+        super().reject()
 
 
 def show_transport_dialog():
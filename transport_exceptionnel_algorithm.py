@@ -11,6 +11,8 @@ from qgis.core import (
     QgsProcessingParameterVectorLayer,
     QgsProcessingParameterRasterLayer,
     QgsProcessingParameterNumber,
+    QgsProcessingParameterBoolean,
+    QgsProcessingParameterDefinition,
     QgsProcessingParameterEnum,
     QgsProcessingParameterFeatureSink,
     QgsProcessingParameterFileDestination,
@@ -27,12 +29,33 @@ from qgis.core import (
     QgsProcessingException,
     QgsGeometryUtils,
     QgsVector,
-    QgsFeatureSink
+    QgsFeatureSink,
+    QgsFeatureRequest,
+    QgsCoordinateTransform
 )
 from qgis import processing
 import numpy as np
 from osgeo import gdal
 import math
+import struct
+import warnings
+
+
+# Point 2D en WKB little-endian : ordre d'octets, type (1 = Point), X, Y
+_WKB_POINT = struct.Struct('<BIdd')
+
+
+def _profile_kernel():
+    """
+    Retourne le noyau parallèle numba d'analyse des profils, ou None si
+    numba n'est pas installé (l'analyse NumPy vectorisée est alors utilisée)
+    """
+    try:
+        from .transport_exceptionnel_kernel import analyze_profiles
+    except ImportError:
+        return None
+    return analyze_profiles
+
 
 class TransportExceptionnelAlgorithm(QgsProcessingAlgorithm):
     """Algorithme principal d'analyse du transport exceptionnel"""
@@ -44,6 +67,7 @@ class TransportExceptionnelAlgorithm(QgsProcessingAlgorithm):
     HEIGHT_REQUIRED = 'HEIGHT_REQUIRED'
     TRANSECT_SPACING = 'TRANSECT_SPACING'
     SAMPLE_POINTS = 'SAMPLE_POINTS'
+    BILINEAR = 'BILINEAR'
     
     # Paramètres de sortie
     OUTPUT_ENVELOPE = 'OUTPUT_ENVELOPE'
@@ -52,6 +76,14 @@ class TransportExceptionnelAlgorithm(QgsProcessingAlgorithm):
     OUTPUT_CSV = 'OUTPUT_CSV'
     OUTPUT_REPORT = 'OUTPUT_REPORT'
     
+    # Taille maximale (en pixels) d'une fenêtre du MNH chargée en mémoire,
+    # soit environ 200 Mo en float32
+    MAX_WINDOW_PIXELS = 50_000_000
+    
+    # Version des résultats : à incrémenter à toute modification de l'analyse
+    # ou des sorties, elle invalide les résultats mis en cache par le dialogue
+    RESULTS_VERSION = 1
+    
     # Configuration des turbines
     TURBINE_SPECS = {
         'N117': {'PaF_av': 1.6, 'PaF_arr': 19.1, 'Empattement': 3, 
@@ -163,6 +195,15 @@ class TransportExceptionnelAlgorithm(QgsProcessingAlgorithm):
             )
         )
         
+        # Interpolation bilinéaire des hauteurs au lieu du plus proche voisin
+        bilinear = QgsProcessingParameterBoolean(
+            self.BILINEAR,
+            self.tr('Interpolation bilinéaire du MNH (sinon plus proche voisin)'),
+            defaultValue=False
+        )
+        bilinear.setFlags(bilinear.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(bilinear)
+        
         # Sorties
         self.addParameter(
             QgsProcessingParameterFeatureSink(
@@ -215,6 +256,7 @@ class TransportExceptionnelAlgorithm(QgsProcessingAlgorithm):
         height_required = self.parameterAsDouble(parameters, self.HEIGHT_REQUIRED, context)
         spacing = self.parameterAsDouble(parameters, self.TRANSECT_SPACING, context)
         sample_points = self.parameterAsInt(parameters, self.SAMPLE_POINTS, context)
+        bilinear = self.parameterAsBoolean(parameters, self.BILINEAR, context)
         
         # Validation
         if trace_layer is None:
@@ -231,120 +273,120 @@ class TransportExceptionnelAlgorithm(QgsProcessingAlgorithm):
         feedback.pushInfo(f"Type de pale: {blade_type} ({specs['blade_length']}m)")
         feedback.pushInfo(f"Largeur de base: {specs['Width']}m")
         
-        # Extraction de la géométrie du tracé
-        feature = next(trace_layer.getFeatures())
-        geom = feature.geometry()
+        # Extraction de la géométrie du tracé : géométries seules (sans
+        # attributs), assemblées une seule fois en une polyligne continue
+        request = QgsFeatureRequest().setNoAttributes()
+        geoms = [f.geometry() for f in trace_layer.getFeatures(request) if f.hasGeometry()]
+        
+        if not geoms:
+            raise QgsProcessingException(self.tr('Le tracé ne contient aucune géométrie'))
+        
+        geom = QgsGeometry.collectGeometry(geoms).mergeLines()
         
         if geom.type() != QgsWkbTypes.LineGeometry:
             raise QgsProcessingException(self.tr('La couche doit être de type LineString'))
         
+        # Les calculs et les sorties sont dans le CRS du MNH : le tracé est
+        # reprojeté en une seule transformation plutôt que point par point
+        crs = mnh_layer.crs()
+        if trace_layer.crs() != crs:
+            transform = QgsCoordinateTransform(trace_layer.crs(), crs, context.transformContext())
+            if not transform.isValid():
+                raise QgsProcessingException(self.tr('Transformation impossible du CRS du tracé vers celui du MNH'))
+            geom.transform(transform)
+            feedback.pushInfo(f"Tracé reprojeté de {trace_layer.crs().authid()} vers {crs.authid()}")
+        
         # Extraction des points
         if geom.isMultipart():
-            points = geom.asMultiPolyline()[0]
+            # Tracé discontinu : seule la partie la plus longue est analysée
+            parts = geom.asMultiPolyline()
+            points = max(parts, key=lambda part: QgsGeometry.fromPolylineXY(part).length())
+            feedback.pushWarning(
+                f"Tracé discontinu ({len(parts)} parties) : seule la plus longue est analysée"
+            )
         else:
             points = geom.asPolyline()
         
-        feedback.pushInfo(f"Tracé: {len(points)} points source")
+        # Coordonnées des sommets converties une seule fois en tableau (N x 2)
+        pts = np.array([[p.x(), p.y()] for p in points], dtype=np.float64)
+        feedback.pushInfo(f"Tracé: {len(pts)} points source")
         
         # Densification du tracé
         feedback.setProgress(10)
-        stations_xy, stations_dist = self.densify_line(points, spacing)
-        feedback.pushInfo(f"Tracé densifié: {len(stations_xy)} stations")
+        sx, sy, stations_dist = self.densify_line(pts, spacing)
+        feedback.pushInfo(f"Tracé densifié: {len(sx)} stations")
         feedback.pushInfo(f"Longueur totale: {stations_dist[-1]:.1f}m")
         
-        # Ouverture du raster MNH
+        # Analyse des profils : les stations sont traitées par blocs sous
+        # forme de tableaux (stations x sample_points)
         feedback.setProgress(20)
+        total_stations = len(sx)
+        convoy_length = self.convoy_length(specs)
+        
+        # Calcul de la largeur dynamique
+        half_widths, radii = self.get_dynamic_half_width(
+            sx, sy, specs['Width'], convoy_length
+        )
+        
+        # Direction (segment suivant, précédent pour la dernière station) et
+        # normale unitaire, calculées composante par composante. Une station
+        # unique (tracé de longueur nulle) garde une direction nulle.
+        dx = np.zeros(total_stations)
+        dy = np.zeros(total_stations)
+        dx[:-1] = np.diff(sx)
+        dy[:-1] = np.diff(sy)
+        if total_stations > 1:
+            dx[-1] = dx[-2]
+            dy[-1] = dy[-2]
+        
+        norm = np.hypot(dx, dy)
+        norm[norm == 0] = 1.0  # Stations confondues : normale nulle
+        normal_x = -dy / norm
+        normal_y = dx / norm
+        
+        # Ouverture du raster MNH
         ds = gdal.Open(mnh_layer.source())
         if ds is None:
             raise QgsProcessingException(self.tr('Impossible d\'ouvrir le raster MNH'))
         
-        band = ds.GetRasterBand(1)
-        nodata = band.GetNoDataValue()
-        gt = ds.GetGeoTransform()
-        
-        # Analyse des profils
+        # Échantillonnage transversal : profil unitaire calculé une fois,
+        # mis à l'échelle de la demi-largeur de chaque station
         feedback.setProgress(30)
-        results = []
-        conflicts = []
-        
-        total_stations = len(stations_xy)
+        samples_unit = np.linspace(-1.0, 1.0, sample_points)
+        max_h, mean_h = self.analyze_profiles(
+            ds, sx, sy, normal_x, normal_y, half_widths, samples_unit,
+            bilinear, feedback
+        )
+        ds = None  # Fermeture du raster
         
-        for idx, station in enumerate(stations_xy):
-            if feedback.isCanceled():
-                break
-            
-            # Calcul de la largeur dynamique
-            dynamic_half_width, radius = self.get_dynamic_half_width(
-                idx, stations_xy, specs['Width'], 
-                specs['blade_length'] + 18.0 / 2
-            )
-            
-            # Direction et normale
-            if idx < len(stations_xy) - 1:
-                direction = np.array([
-                    stations_xy[idx + 1].x() - station.x(),
-                    stations_xy[idx + 1].y() - station.y()
-                ])
-            else:
-                direction = np.array([
-                    station.x() - stations_xy[idx - 1].x(),
-                    station.y() - stations_xy[idx - 1].y()
-                ])
-            
-            norm = np.linalg.norm(direction)
-            if norm > 0:
-                direction = direction / norm
-            
-            normal = np.array([-direction[1], direction[0]])
-            
-            # Échantillonnage transversal
-            samples = np.linspace(-dynamic_half_width, dynamic_half_width, sample_points)
-            xs = station.x() + samples * normal[0]
-            ys = station.y() + samples * normal[1]
-            
-            # Lecture des hauteurs
-            heights = self.sample_raster(ds, band, gt, nodata, xs, ys)
-            
-            valid_heights = heights[~np.isnan(heights)]
-            
-            if len(valid_heights) > 0:
-                max_h = float(np.max(valid_heights))
-                mean_h = float(np.mean(valid_heights))
-                clearance_ok = max_h < height_required
-            else:
-                max_h = np.nan
-                mean_h = np.nan
-                clearance_ok = True
-            
-            sweep = dynamic_half_width - specs['Width'] / 2
-            
-            results.append({
-                'station': idx,
-                'distance_m': stations_dist[idx],
-                'x': station.x(),
-                'y': station.y(),
-                'max_height_m': max_h,
-                'mean_height_m': mean_h,
-                'clearance_ok': clearance_ok,
-                'curve_radius_m': radius if radius != np.inf else -1,
-                'dynamic_half_width_m': dynamic_half_width,
-                'lateral_sweep_m': sweep
-            })
-            
-            if not clearance_ok and not np.isnan(max_h):
-                conflicts.append({
-                    'station': idx,
-                    'distance_m': stations_dist[idx],
-                    'x': station.x(),
-                    'y': station.y(),
-                    'max_height_m': max_h,
-                    'exceedance_m': max_h - height_required,
-                    'dynamic_half_width_m': dynamic_half_width
-                })
-            
-            feedback.setProgress(30 + int(50 * idx / total_stations))
+        clearance_ok = np.isnan(max_h) | (max_h < height_required)
+        
+        sweep = half_widths - specs['Width'] / 2
+        # Rayon infini (ligne droite) écrit -1, en entier comme auparavant
+        curve_radius = radii.astype(object)
+        curve_radius[np.isinf(radii)] = -1
+        
+        if feedback.isCanceled():
+            return {}
+        
+        # Résultats stockés par colonne (un tableau par attribut)
+        results = {
+            'station': np.arange(total_stations),
+            'distance_m': stations_dist,
+            'x': sx,
+            'y': sy,
+            'max_height_m': max_h,
+            'mean_height_m': mean_h,
+            'clearance_ok': clearance_ok,
+            'curve_radius_m': curve_radius,
+            'dynamic_half_width_m': half_widths,
+            'lateral_sweep_m': sweep
+        }
         
-        ds = None  # Fermeture du raster
+        # Stations en conflit : indices issus du masque de dégagement
+        # (les stations sans donnée MNH sont déjà considérées dégagées)
+        conflicts_idx = np.nonzero(~clearance_ok)[0]
+        exceedance = max_h - height_required
         
         # Création des couches de sortie
         feedback.setProgress(80)
@@ -358,23 +400,32 @@ class TransportExceptionnelAlgorithm(QgsProcessingAlgorithm):
         
         (envelope_sink, envelope_dest) = self.parameterAsSink(
             parameters, self.OUTPUT_ENVELOPE, context,
-            envelope_fields, QgsWkbTypes.Polygon, trace_layer.crs()
+            envelope_fields, QgsWkbTypes.MultiPolygon, crs
         )
         
         if envelope_sink is None:
             raise QgsProcessingException(self.tr('Impossible de créer la couche enveloppe'))
         
         feedback.pushInfo("Génération de l'enveloppe dynamique...")
-        envelope_geom = self.create_dynamic_envelope(stations_xy, results, specs['Width'])
+        envelope_geom = self.create_dynamic_envelope(sx, sy, normal_x, normal_y, half_widths)
         
         if envelope_geom is None or envelope_geom.isEmpty():
             feedback.pushWarning("Enveloppe vide - problème de génération")
         else:
+            # Contrôle : chaque profil échantillonné doit être dans l'enveloppe
+            uncovered = self.uncovered_profile_length(
+                envelope_geom, sx, sy, normal_x, normal_y, half_widths
+            )
+            if uncovered > 1e-3:
+                feedback.pushWarning(
+                    f"Enveloppe incomplète : {uncovered:.2f} m de profils hors enveloppe"
+                )
+            
             envelope_feat = QgsFeature(envelope_fields)
             envelope_feat.setGeometry(envelope_geom)
             envelope_feat.setAttributes([
                 blade_type,
-                max([r['dynamic_half_width_m'] for r in results]) * 2,
+                float(half_widths.max()) * 2,
                 stations_dist[-1]
             ])
             if not envelope_sink.addFeature(envelope_feat, QgsFeatureSink.FastInsert):
@@ -382,6 +433,10 @@ class TransportExceptionnelAlgorithm(QgsProcessingAlgorithm):
             else:
                 feedback.pushInfo(f"Enveloppe créée: {envelope_feat.geometry().area():.1f} m²")
         
+        # Fermeture de chaque couche dès qu'elle est écrite : les sorties
+        # peuvent partager un même GeoPackage
+        envelope_sink = None
+        
         # Stations
         stations_fields = QgsFields()
         stations_fields.append(QgsField('station', QVariant.Int))
@@ -392,32 +447,39 @@ class TransportExceptionnelAlgorithm(QgsProcessingAlgorithm):
         
         (stations_sink, stations_dest) = self.parameterAsSink(
             parameters, self.OUTPUT_STATIONS, context,
-            stations_fields, QgsWkbTypes.Point, trace_layer.crs()
+            stations_fields, QgsWkbTypes.Point, crs
         )
         
         if stations_sink is None:
             raise QgsProcessingException(self.tr('Impossible de créer la couche stations'))
         
-        feedback.pushInfo(f"Ajout de {len(results)} stations...")
-        features_added = 0
-        for r in results:
+        feedback.pushInfo(f"Ajout de {total_stations} stations...")
+        features = []
+        for idx, (x, y, dist, h_max, ok, width) in enumerate(zip(
+            sx.tolist(), sy.tolist(), stations_dist.tolist(), max_h.tolist(),
+            clearance_ok.tolist(), (half_widths * 2).tolist()
+        )):
             feat = QgsFeature(stations_fields)
-            feat.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(r['x'], r['y'])))
+            feat.setGeometry(self.point_geometry(x, y))
             feat.setAttributes([
-                r['station'],
-                r['distance_m'],
-                r['max_height_m'],
-                'OK' if r['clearance_ok'] else 'OBSTACLE',
-                r['dynamic_half_width_m'] * 2
+                idx,
+                dist,
+                h_max,
+                'OK' if ok else 'OBSTACLE',
+                width
             ])
-            if stations_sink.addFeature(feat, QgsFeatureSink.FastInsert):
-                features_added += 1
+            features.append(feat)
         
-        feedback.pushInfo(f"{features_added}/{len(results)} stations ajoutées")
+        # Insertion groupée en un seul appel
+        if stations_sink.addFeatures(features, QgsFeatureSink.FastInsert):
+            feedback.pushInfo(f"{len(features)} stations ajoutées")
+        else:
+            feedback.pushWarning("Échec de l'ajout des stations")
+        stations_sink = None
         
         # Obstacles
         obstacles_dest = None
-        if conflicts:
+        if conflicts_idx.size:
             obstacles_fields = QgsFields()
             obstacles_fields.append(QgsField('station', QVariant.Int))
             obstacles_fields.append(QgsField('distance_m', QVariant.Double))
@@ -426,21 +488,23 @@ class TransportExceptionnelAlgorithm(QgsProcessingAlgorithm):
             
             (obstacles_sink, obstacles_dest) = self.parameterAsSink(
                 parameters, self.OUTPUT_OBSTACLES, context,
-                obstacles_fields, QgsWkbTypes.Point, trace_layer.crs()
+                obstacles_fields, QgsWkbTypes.Point, crs
             )
             
             if obstacles_sink is not None:
-                feedback.pushInfo(f"Ajout de {len(conflicts)} obstacles...")
-                for c in conflicts:
+                feedback.pushInfo(f"Ajout de {conflicts_idx.size} obstacles...")
+                features = []
+                for idx, x, y, dist, h_max, exceed in zip(
+                    conflicts_idx.tolist(), sx[conflicts_idx].tolist(),
+                    sy[conflicts_idx].tolist(), stations_dist[conflicts_idx].tolist(),
+                    max_h[conflicts_idx].tolist(), exceedance[conflicts_idx].tolist()
+                ):
                     feat = QgsFeature(obstacles_fields)
-                    feat.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(c['x'], c['y'])))
-                    feat.setAttributes([
-                        c['station'],
-                        c['distance_m'],
-                        c['max_height_m'],
-                        c['exceedance_m']
-                    ])
-                    obstacles_sink.addFeature(feat, QgsFeatureSink.FastInsert)
+                    feat.setGeometry(self.point_geometry(x, y))
+                    feat.setAttributes([idx, dist, h_max, exceed])
+                    features.append(feat)
+                obstacles_sink.addFeatures(features, QgsFeatureSink.FastInsert)
+                obstacles_sink = None
         
         # Export CSV et rapport
         feedback.setProgress(90)
@@ -448,16 +512,16 @@ class TransportExceptionnelAlgorithm(QgsProcessingAlgorithm):
         report_path = self.parameterAsFileOutput(parameters, self.OUTPUT_REPORT, context)
         
         self.export_csv(results, csv_path)
-        self.export_report(results, conflicts, blade_type, specs, 
+        self.export_report(results, conflicts_idx, exceedance, blade_type, specs, 
                           height_required, stations_dist[-1], report_path)
         
         feedback.pushInfo(f"\n{'='*60}")
-        if len(conflicts) == 0:
+        if conflicts_idx.size == 0:
             feedback.pushInfo("RESULTAT: PASSAGE POSSIBLE")
             feedback.pushInfo("  Aucun obstacle detecte")
         else:
-            feedback.pushInfo(f"RESULTAT: {len(conflicts)} OBSTACLES DETECTES")
-            feedback.pushInfo(f"  Hauteur max: {max([c['max_height_m'] for c in conflicts]):.2f}m")
+            feedback.pushInfo(f"RESULTAT: {conflicts_idx.size} OBSTACLES DETECTES")
+            feedback.pushInfo(f"  Hauteur max: {max_h[conflicts_idx].max():.2f}m")
         feedback.pushInfo(f"{'='*60}\n")
         
         feedback.setProgress(100)
@@ -465,188 +529,397 @@ class TransportExceptionnelAlgorithm(QgsProcessingAlgorithm):
         return {
             self.OUTPUT_ENVELOPE: envelope_dest,
             self.OUTPUT_STATIONS: stations_dest,
-            self.OUTPUT_OBSTACLES: obstacles_dest if conflicts else None,
+            self.OUTPUT_OBSTACLES: obstacles_dest if conflicts_idx.size else None,
             self.OUTPUT_CSV: csv_path,
             self.OUTPUT_REPORT: report_path
         }
     
-    def densify_line(self, points, spacing):
-        """Densifie une ligne avec un espacement régulier"""
-        stations = [points[0]]
-        distances = [0.0]
-        cumul_dist = 0.0
-        
-        for i in range(len(points) - 1):
-            p1 = points[i]
-            p2 = points[i + 1]
-            segment_length = math.sqrt((p2.x() - p1.x())**2 + (p2.y() - p1.y())**2)
-            
-            num_segments = int(math.ceil(segment_length / spacing))
-            
-            for j in range(1, num_segments + 1):
-                t = j / num_segments
-                x = p1.x() + t * (p2.x() - p1.x())
-                y = p1.y() + t * (p2.y() - p1.y())
-                cumul_dist += segment_length / num_segments
-                
-                stations.append(QgsPointXY(x, y))
-                distances.append(cumul_dist)
-        
-        return stations, np.array(distances)
+    def densify_line(self, pts, spacing):
+        """
+        Densifie une ligne avec un espacement régulier
+        
+        pts est le tableau (N x 2) des sommets du tracé. Retourne les
+        coordonnées X, Y des stations et leur distance cumulée.
+        """
+        px = pts[:, 0]
+        py = pts[:, 1]
+        
+        dx = np.diff(px)
+        dy = np.diff(py)
+        segment_length = np.hypot(dx, dy)
+        num_segments = np.ceil(segment_length / spacing).astype(np.int64)
+        
+        # Segment d'origine et rang j (1..n) de chaque station créée
+        seg = np.repeat(np.arange(len(segment_length)), num_segments)
+        first = np.repeat(np.cumsum(num_segments) - num_segments, num_segments)
+        j = np.arange(len(seg)) - first + 1
+        t = j / num_segments[seg]
+        
+        xs = np.concatenate(([px[0]], px[seg] + t * dx[seg]))
+        ys = np.concatenate(([py[0]], py[seg] + t * dy[seg]))
+        
+        step = segment_length / np.maximum(num_segments, 1)
+        distances = np.concatenate(([0.0], np.cumsum(step[seg])))
+        
+        return xs, ys, distances
     
-    def calculate_curve_radius(self, stations, idx, window=3):
-        """Calcule le rayon de courbure local"""
-        if idx == 0 or idx >= len(stations) - 1:
-            return np.inf
-        
-        i_before = max(0, idx - window)
-        i_after = min(len(stations) - 1, idx + window)
-        
-        v_before = np.array([
-            stations[idx].x() - stations[i_before].x(),
-            stations[idx].y() - stations[i_before].y()
-        ])
+    def calculate_curve_radius(self, sx, sy, window=3):
+        """Calcule le rayon de courbure local de chaque station (inf en ligne droite)"""
+        n = len(sx)
+        idx = np.arange(n)
+        i_before = np.maximum(idx - window, 0)
+        i_after = np.minimum(idx + window, n - 1)
+        
+        vbx = sx - sx[i_before]
+        vby = sy - sy[i_before]
+        vax = sx[i_after] - sx
+        vay = sy[i_after] - sy
+        
+        norm_before = np.hypot(vbx, vby)
+        norm_after = np.hypot(vax, vay)
+        chord_length = np.hypot(sx[i_after] - sx[i_before], sy[i_after] - sy[i_before])
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cos_angle = np.clip((vbx * vax + vby * vay) / (norm_before * norm_after), -1, 1)
+            angle = np.arccos(cos_angle)
+            radius = np.abs(chord_length / (2 * np.sin(angle / 2)))
+        
+        # Extrémités, stations confondues et angles < ~0.5° : ligne droite
+        straight = (
+            (idx == 0) | (idx >= n - 1) |
+            (norm_before < 1e-6) | (norm_after < 1e-6) |
+            (angle < 0.009)
+        )
         
-        v_after = np.array([
-            stations[i_after].x() - stations[idx].x(),
-            stations[i_after].y() - stations[idx].y()
-        ])
+        return np.where(straight, np.inf, radius)
+    
+    @staticmethod
+    def convoy_length(specs):
+        """Longueur de convoi prise en compte pour le balayage (m)"""
+        return specs['blade_length'] + 18.0 / 2
+    
+    def get_dynamic_half_width(self, sx, sy, base_width, convoy_length):
+        """Calcule la demi-largeur dynamique de chaque station avec balayage dans les virages"""
+        radius = self.calculate_curve_radius(sx, sy)
+        
+        with np.errstate(divide='ignore'):
+            sweep = np.where(
+                radius > 500, 0.0,
+                np.where(radius < 10, convoy_length * 0.5, convoy_length ** 2 / (2 * radius))
+            )
         
-        norm_before = np.linalg.norm(v_before)
-        norm_after = np.linalg.norm(v_after)
+        return base_width / 2 + sweep, radius
+    
+    def analyze_profiles(self, ds, sx, sy, normal_x, normal_y, half_widths,
+                         samples_unit, bilinear, feedback):
+        """
+        Calcule les hauteurs max et moyenne du profil de chaque station
+        
+        Le MNH est lu par blocs de stations consécutives : la fenêtre d'un
+        bloc (ses profils) reste sous MAX_WINDOW_PIXELS, de sorte qu'un long
+        tracé en diagonale ne charge jamais toute son emprise en mémoire.
+        Un tracé compact est lu en une seule fois.
+        """
+        gt = ds.GetGeoTransform()
+        pixel_area = abs(gt[1] * gt[5])
+        kernel = None if bilinear else _profile_kernel()
+        
+        # Emprise de chaque profil : la station +/- sa demi-largeur
+        xmin = sx - half_widths
+        xmax = sx + half_widths
+        ymin = sy - half_widths
+        ymax = sy + half_widths
+        
+        n = len(sx)
+        max_h = np.full(n, np.nan)
+        mean_h = np.full(n, np.nan)
+        blocks = 0
+        
+        start = 0
+        while start < n and not feedback.isCanceled():
+            # Nombre de pixels de la fenêtre cumulée des stations suivantes :
+            # le bloc s'arrête avant la première station qui dépasse le budget
+            window_pixels = (
+                (np.maximum.accumulate(xmax[start:]) - np.minimum.accumulate(xmin[start:])) *
+                (np.maximum.accumulate(ymax[start:]) - np.minimum.accumulate(ymin[start:]))
+            ) / pixel_area
+            over = np.nonzero(window_pixels > self.MAX_WINDOW_PIXELS)[0]
+            stop = start + max(int(over[0]), 1) if over.size else n
+            block = slice(start, stop)
+            
+            try:
+                mnh, window_gt = self.read_mnh_window(
+                    ds, xmin[block].min(), ymin[block].min(),
+                    xmax[block].max(), ymax[block].max()
+                )
+            except QgsProcessingException:
+                mnh = None  # Bloc hors de l'emprise du MNH : hauteurs NaN
+            
+            if mnh is not None:
+                blocks += 1
+                if kernel is not None:
+                    # Analyse parallèle station par station (numba)
+                    max_h[block], mean_h[block] = kernel(
+                        sx[block], sy[block], normal_x[block], normal_y[block],
+                        half_widths[block], samples_unit,
+                        mnh, np.asarray(window_gt, dtype=np.float64)
+                    )
+                else:
+                    samples = half_widths[block, None] * samples_unit
+                    xs = sx[block, None] + samples * normal_x[block, None]
+                    ys = sy[block, None] + samples * normal_y[block, None]
+                    
+                    # Lecture des hauteurs en un seul appel sur la grille du bloc
+                    if bilinear:
+                        heights = self.sample_array_bilinear(mnh, window_gt, xs, ys)
+                    else:
+                        heights = self.sample_raster(mnh, window_gt, xs, ys)
+                    
+                    # Profils sans aucune donnée valide : NaN, sans avertissement
+                    with np.errstate(all='ignore'), warnings.catch_warnings():
+                        warnings.simplefilter('ignore', RuntimeWarning)
+                        max_h[block] = np.nanmax(heights, axis=1)
+                        mean_h[block] = np.nanmean(heights, axis=1, dtype=np.float64)
+                mnh = None
+            
+            start = stop
+            feedback.setProgress(30 + 50 * stop / n)
         
-        if norm_before < 1e-6 or norm_after < 1e-6:
-            return np.inf
+        if blocks == 0 and not feedback.isCanceled():
+            raise QgsProcessingException(self.tr('Le tracé ne recoupe pas l\'emprise du MNH'))
+        if blocks > 1:
+            feedback.pushInfo(f"MNH lu en {blocks} blocs de stations")
         
-        cos_angle = np.clip(np.dot(v_before, v_after) / (norm_before * norm_after), -1, 1)
-        angle = np.arccos(cos_angle)
+        return max_h, mean_h
+    
+    def read_mnh_window(self, ds, xmin, ymin, xmax, ymax):
+        """
+        Charge en mémoire la fenêtre du MNH couvrant l'emprise donnée
         
-        if angle < 0.009:  # ~0.5°
-            return np.inf
+        Les valeurs invalides (NoData, hors plage) sont remplacées par NaN.
+        Retourne le tableau et le géoréférencement propre à la fenêtre.
+        """
+        band = ds.GetRasterBand(1)
+        nodata = band.GetNoDataValue()
+        gt = ds.GetGeoTransform()
         
-        chord_length = math.sqrt(
-            (stations[i_after].x() - stations[i_before].x())**2 +
-            (stations[i_after].y() - stations[i_before].y())**2
+        # Emprise -> indices pixel, bornés à l'étendue du raster. Une cellule
+        # de plus de chaque côté : l'interpolation bilinéaire d'un point en
+        # bordure lit aussi la cellule voisine
+        cols = sorted(((xmin - gt[0]) / gt[1], (xmax - gt[0]) / gt[1]))
+        rows = sorted(((ymin - gt[3]) / gt[5], (ymax - gt[3]) / gt[5]))
+        px0 = max(0, int(math.floor(cols[0])) - 1)
+        px1 = min(ds.RasterXSize, int(math.ceil(cols[1])) + 1)
+        py0 = max(0, int(math.floor(rows[0])) - 1)
+        py1 = min(ds.RasterYSize, int(math.ceil(rows[1])) + 1)
+        
+        if px1 <= px0 or py1 <= py0:
+            raise QgsProcessingException(self.tr('Le tracé ne recoupe pas l\'emprise du MNH'))
+        
+        # Conversion en float32 faite par GDAL à la lecture, sans copie
+        mnh = band.ReadAsArray(
+            px0, py0, px1 - px0, py1 - py0, buf_type=gdal.GDT_Float32
+        ).astype(np.float32, copy=False)
+        
+        # Masquage sur place, un seul masque temporaire à la fois
+        mnh[mnh < -100] = np.nan
+        mnh[mnh > 200] = np.nan
+        if nodata is not None:
+            with np.errstate(over='ignore'):
+                mnh[mnh == np.float32(nodata)] = np.nan
+        
+        window_gt = (
+            gt[0] + px0 * gt[1], gt[1], gt[2],
+            gt[3] + py0 * gt[5], gt[4], gt[5]
         )
-        
-        if angle > 0:
-            return abs(chord_length / (2 * np.sin(angle / 2)))
-        
-        return np.inf
+        return mnh, window_gt
     
-    def get_dynamic_half_width(self, idx, stations, base_width, convoy_length):
-        """Calcule la largeur dynamique avec balayage dans les virages"""
-        radius = self.calculate_curve_radius(stations, idx)
-        
-        if radius == np.inf or radius > 500:
-            sweep = 0.0
-        elif radius < 10:
-            sweep = convoy_length * 0.5
-        else:
-            sweep = (convoy_length ** 2) / (2 * radius)
-        
-        return base_width / 2 + sweep, radius
+    def point_geometry(self, x, y):
+        """Construit une géométrie point directement depuis son WKB"""
+        geom = QgsGeometry()
+        geom.fromWkb(_WKB_POINT.pack(1, 1, x, y))
+        return geom
+    
+    def sample_raster(self, mnh, gt, xs, ys):
+        """
+        Échantillonne au plus proche voisin le MNH chargé en mémoire
+        
+        xs et ys peuvent être de forme quelconque (N stations x points par
+        profil) : la lecture est une seule indexation vectorisée.
+        """
+        rows, cols = mnh.shape
+        inv_gx = 1.0 / gt[1]
+        inv_gy = 1.0 / gt[5]
+        px = ((xs - gt[0]) * inv_gx).astype(np.int32)
+        py = ((ys - gt[3]) * inv_gy).astype(np.int32)
+        
+        inside = (px >= 0) & (px < cols) & (py >= 0) & (py < rows)
+        values = mnh[np.clip(py, 0, rows - 1), np.clip(px, 0, cols - 1)]
+        
+        return np.where(inside, values, np.nan)
     
-    def sample_raster(self, ds, band, gt, nodata, xs, ys):
-        """Échantillonne le raster aux coordonnées données"""
-        values = []
+    def sample_array_bilinear(self, mnh, gt, xs, ys):
+        """
+        Échantillonne par interpolation bilinéaire un MNH chargé en mémoire
+        
+        Les poids sont renormalisés sur les cellules voisines valides : une
+        cellule NoData voisine n'invalide pas le point échantillonné.
+        """
+        rows, cols = mnh.shape
+        
+        # Coordonnées pixel rapportées aux centres des cellules
+        inv_gx = 1.0 / gt[1]
+        inv_gy = 1.0 / gt[5]
+        col = (xs - gt[0]) * inv_gx - 0.5
+        row = (ys - gt[3]) * inv_gy - 0.5
+        inside = (col >= -0.5) & (col <= cols - 0.5) & (row >= -0.5) & (row <= rows - 0.5)
+        
+        col = np.clip(col, 0, cols - 1)
+        row = np.clip(row, 0, rows - 1)
+        col0 = np.floor(col).astype(np.int64)
+        row0 = np.floor(row).astype(np.int64)
+        col1 = np.minimum(col0 + 1, cols - 1)
+        row1 = np.minimum(row0 + 1, rows - 1)
+        fx = col - col0
+        fy = row - row0
+        
+        corners = (
+            (mnh[row0, col0], (1 - fx) * (1 - fy)),
+            (mnh[row0, col1], fx * (1 - fy)),
+            (mnh[row1, col0], (1 - fx) * fy),
+            (mnh[row1, col1], fx * fy)
+        )
         
-        for x, y in zip(xs, ys):
-            px = int((x - gt[0]) / gt[1])
-            py = int((y - gt[3]) / gt[5])
-            
-            if 0 <= px < ds.RasterXSize and 0 <= py < ds.RasterYSize:
-                val = band.ReadAsArray(px, py, 1, 1)[0, 0]
-                if nodata is not None and val == nodata:
-                    values.append(np.nan)
-                elif val < -100 or val > 200:
-                    values.append(np.nan)
-                else:
-                    values.append(val)
-            else:
-                values.append(np.nan)
+        # Somme pondérée des seules cellules valides (NaN exclus)
+        weighted = np.zeros(fx.shape)
+        weights = np.zeros(fx.shape)
+        for value, weight in corners:
+            valid = ~np.isnan(value)
+            weighted += np.where(valid, value * weight, 0.0)
+            weights += np.where(valid, weight, 0.0)
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = weighted / weights
         
-        return np.array(values)
+        return np.where(inside & (weights > 0), values, np.nan)
+    
+    def profile_ends(self, sx, sy, normal_x, normal_y, half_widths):
+        """Extrémités gauche et droite du profil transversal de chaque station"""
+        return (
+            sx + normal_x * half_widths, sy + normal_y * half_widths,
+            sx - normal_x * half_widths, sy - normal_y * half_widths
+        )
     
-    def create_dynamic_envelope(self, stations, results, base_width):
-        """Crée l'enveloppe dynamique par buffers"""
+    def create_dynamic_envelope(self, sx, sy, normal_x, normal_y, half_widths, cap_segments=8):
+        """
+        Crée l'enveloppe dynamique comme l'union des surfaces balayées
+        
+        Chaque pièce est l'enveloppe convexe de deux profils consécutifs : une
+        pièce ne peut pas se vriller, même quand la demi-largeur change
+        brutalement dans un virage. Les extrémités sont des demi-disques.
+        Retourne un multipolygone.
+        """
         try:
-            from shapely.geometry import Point
-            from shapely.ops import unary_union
-            
-            buffers = []
-            step = max(1, len(stations) // 200)
-            
-            for i in range(0, len(stations), step):
-                pt = Point(stations[i].x(), stations[i].y())
-                radius = results[i]['dynamic_half_width_m']
-                buffers.append(pt.buffer(radius))
-            
-            if not buffers:
-                return None
-            
-            envelope = unary_union(buffers)
-            
-            if envelope.geom_type == 'MultiPolygon':
-                envelope = max(envelope.geoms, key=lambda p: p.area)
+            left_x, left_y, right_x, right_y = self.profile_ends(
+                sx, sy, normal_x, normal_y, half_widths
+            )
+            left = [QgsPointXY(x, y) for x, y in zip(left_x.tolist(), left_y.tolist())]
+            right = [QgsPointXY(x, y) for x, y in zip(right_x.tolist(), right_y.tolist())]
             
-            coords = list(envelope.exterior.coords)
-            qgs_points = [QgsPointXY(x, y) for x, y in coords]
+            pieces = [
+                QgsGeometry.fromMultiPointXY([left[i], left[i + 1], right[i + 1], right[i]]).convexHull()
+                for i in range(len(left) - 1)
+            ]
             
-            return QgsGeometry.fromPolygonXY([qgs_points])
+            # Demi-disques aux extrémités, de la normale vers son opposé en
+            # passant par l'avant (fin du tracé) ou par l'arrière (début)
+            steps = np.arange(cap_segments + 1) * np.pi / cap_segments
+            for idx, start in ((-1, 0.0), (0, np.pi)):
+                angles = math.atan2(normal_y[idx], normal_x[idx]) + start - steps
+                arc_x = sx[idx] + half_widths[idx] * np.cos(angles)
+                arc_y = sy[idx] + half_widths[idx] * np.sin(angles)
+                cap = [QgsPointXY(sx[idx], sy[idx])]
+                cap.extend(QgsPointXY(x, y) for x, y in zip(arc_x.tolist(), arc_y.tolist()))
+                pieces.append(QgsGeometry.fromMultiPointXY(cap).convexHull())
             
-        except ImportError:
-            # Si shapely n'est pas disponible, utiliser un buffer simple QGIS
-            line_points = [QgsPoint(s.x(), s.y()) for s in stations]
-            line_geom = QgsGeometry.fromPolyline(line_points)
+            # Pièces dégénérées (stations confondues) écartées
+            envelope = QgsGeometry.unaryUnion([
+                piece for piece in pieces if piece.type() == QgsWkbTypes.PolygonGeometry
+            ])
             
-            # Buffer avec la largeur maximale
-            max_width = max([r['dynamic_half_width_m'] for r in results])
-            return line_geom.buffer(max_width, 25)
+            envelope.convertToMultiType()
+            return envelope
             
         except Exception as e:
             # En cas d'erreur, retourner un buffer simple
-            line_points = [QgsPoint(s.x(), s.y()) for s in stations]
+            line_points = [QgsPoint(x, y) for x, y in zip(sx.tolist(), sy.tolist())]
             line_geom = QgsGeometry.fromPolyline(line_points)
-            max_width = max([r['dynamic_half_width_m'] for r in results])
-            return line_geom.buffer(max_width, 25)
+            max_width = float(half_widths.max())
+            envelope = line_geom.buffer(max_width, 25)
+            envelope.convertToMultiType()
+            return envelope
     
-    def export_csv(self, results, path):
-        """Exporte les résultats en CSV"""
+    def uncovered_profile_length(self, envelope, sx, sy, normal_x, normal_y, half_widths):
+        """Longueur cumulée (m) des profils transversaux situés hors de l'enveloppe"""
+        left_x, left_y, right_x, right_y = self.profile_ends(
+            sx, sy, normal_x, normal_y, half_widths
+        )
+        profiles = QgsGeometry.fromMultiPolylineXY([
+            [QgsPointXY(lx, ly), QgsPointXY(rx, ry)]
+            for lx, ly, rx, ry in zip(
+                left_x.tolist(), left_y.tolist(), right_x.tolist(), right_y.tolist()
+            )
+        ])
+        return profiles.difference(envelope).length()
+    
+    def export_csv(self, columns, path):
+        """Exporte les résultats en CSV à partir d'un tableau par colonne"""
         import csv
         
         with open(path, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=results[0].keys())
-            writer.writeheader()
-            writer.writerows(results)
+            writer = csv.writer(f)
+            writer.writerow(columns.keys())
+            writer.writerows(zip(*(values.tolist() for values in columns.values())))
     
-    def export_report(self, results, conflicts, blade_type, specs, 
+    def export_report(self, results, conflicts_idx, exceedance, blade_type, specs, 
                      height_required, total_length, path):
-        """Génère le rapport texte"""
-        with open(path, 'w', encoding='utf-8') as f:
-            f.write("="*70 + "\n")
-            f.write("RAPPORT D'ANALYSE - TRANSPORT EXCEPTIONNEL EOLIENNES\n")
-            f.write("="*70 + "\n\n")
-            
-            f.write(f"Type de pale: {blade_type}\n")
-            f.write(f"Longueur pale: {specs['blade_length']}m\n")
-            f.write(f"Largeur de base: {specs['Width']}m\n")
-            f.write(f"Hauteur requise: < {height_required}m\n\n")
+        """Génère le rapport texte (assemblé en mémoire, écrit en une fois)"""
+        max_width = float(results['dynamic_half_width_m'].max()) * 2
+        
+        lines = [
+            "="*70 + "\n",
+            "RAPPORT D'ANALYSE - TRANSPORT EXCEPTIONNEL EOLIENNES\n",
+            "="*70 + "\n\n",
             
-            f.write(f"Longueur totale trace: {total_length:.1f}m\n")
-            f.write(f"Nombre de stations: {len(results)}\n\n")
+            f"Type de pale: {blade_type}\n",
+            f"Longueur pale: {specs['blade_length']}m\n",
+            f"Largeur de base: {specs['Width']}m\n",
+            f"Hauteur requise: < {height_required}m\n\n",
             
-            max_width = max([r['dynamic_half_width_m'] * 2 for r in results])
-            f.write(f"Largeur maximale requise: {max_width:.2f}m\n\n")
+            f"Longueur totale trace: {total_length:.1f}m\n",
+            f"Nombre de stations: {len(results['station'])}\n\n",
             
-            if len(conflicts) == 0:
-                f.write("RESULTAT: PASSAGE POSSIBLE\n")
-                f.write("Aucun obstacle detecte.\n")
-            else:
-                f.write(f"RESULTAT: {len(conflicts)} OBSTACLES DETECTES\n\n")
-                f.write("DETAIL DES OBSTACLES:\n")
-                for i, c in enumerate(conflicts[:20], 1):
-                    f.write(f"\n  Obstacle #{i}:\n")
-                    f.write(f"    PK: {c['distance_m']/1000:.3f} km\n")
-                    f.write(f"    Hauteur: {c['max_height_m']:.2f}m\n")
-                    f.write(f"    Depassement: +{c['exceedance_m']:.2f}m\n")
\ No newline at end of file
+            f"Largeur maximale requise: {max_width:.2f}m\n\n",
+        ]
+        
+        if conflicts_idx.size == 0:
+            lines.append("RESULTAT: PASSAGE POSSIBLE\n")
+            lines.append("Aucun obstacle detecte.\n")
+        else:
+            lines.append(f"RESULTAT: {conflicts_idx.size} OBSTACLES DETECTES\n\n")
+            lines.append("DETAIL DES OBSTACLES:\n")
+            shown = conflicts_idx[:20]
+            lines.extend(
+                f"\n  Obstacle #{i}:\n"
+                f"    PK: {dist/1000:.3f} km\n"
+                f"    Hauteur: {h_max:.2f}m\n"
+                f"    Depassement: +{exceed:.2f}m\n"
+                for i, (dist, h_max, exceed) in enumerate(zip(
+                    results['distance_m'][shown].tolist(),
+                    results['max_height_m'][shown].tolist(),
+                    exceedance[shown].tolist()
+                ), 1)
+            )
+        
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("".join(lines))
\ No newline at end of file
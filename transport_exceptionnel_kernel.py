@@ -0,0 +1,57 @@
+"""
+Noyau numba de l'analyse des profils (dépendance optionnelle)
+
+Ce module n'est importé par l'algorithme que si numba est installé. La
+compilation a lieu au premier appel puis est mise en cache sur disque
+(cache=True, dans __pycache__ ou le dossier de cache de numba) : seule la
+toute première analyse paie ce coût, pas chaque session QGIS.
+"""
+
+import numpy as np
+from numba import njit, prange
+
+
+# Pas de fastmath : les tests de NaN doivent rester valides
+@njit(parallel=True, cache=True)
+def analyze_profiles(sx, sy, normal_x, normal_y, half_widths, samples_unit, mnh, gt):
+    """
+    Hauteurs max et moyenne du profil de chaque station
+    
+    Chaque station est traitée indépendamment (prange) : échantillonnage au
+    plus proche voisin du MNH en mémoire, puis réduction des valeurs valides.
+    Les profils sans aucune valeur valide donnent NaN.
+    """
+    n = sx.shape[0]
+    rows, cols = mnh.shape
+    max_h = np.full(n, np.nan)
+    mean_h = np.full(n, np.nan)
+    
+    # Géotransformation inverse : multiplications au lieu de divisions
+    ox = gt[0]
+    oy = gt[3]
+    inv_gx = 1.0 / gt[1]
+    inv_gy = 1.0 / gt[5]
+    
+    for i in prange(n):
+        h_max = -np.inf
+        h_sum = 0.0
+        count = 0
+        for s in samples_unit:
+            offset = s * half_widths[i]
+            px = int((sx[i] + offset * normal_x[i] - ox) * inv_gx)
+            py = int((sy[i] + offset * normal_y[i] - oy) * inv_gy)
+            if px < 0 or px >= cols or py < 0 or py >= rows:
+                continue
+            # Cumul en float64, comme la moyenne numpy : mêmes résultats
+            # avec ou sans numba
+            h = np.float64(mnh[py, px])
+            if np.isnan(h):
+                continue
+            h_max = max(h_max, h)
+            h_sum += h
+            count += 1
+        if count > 0:
+            max_h[i] = h_max
+            mean_h[i] = h_sum / count
+    
+    return max_h, mean_h
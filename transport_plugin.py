@@ -72,5 +72,8 @@ class TransportExceptionnelPlugin:
     
     def run(self):
         """Lance l'interface du plugin"""
+        # Import local : le dialogue et ses dépendances (Processing, GDAL)
+        # ne sont chargés qu'au premier clic, pas au démarrage de QGIS.
+        # Ne pas remonter cet import en tête de module.
         from .transport_dialog import show_transport_dialog
         show_transport_dialog()
\ No newline at end of file